@@ -1,6 +1,6 @@
 
 import React, { useState, useMemo } from 'react';
-import { AggregatedAnalysis, AnalysisResult, RiskCategory, InventoryItem } from '../types';
+import { AggregatedAnalysis, AnalysisResult, RiskCategory, InventoryItem, ExecutiveReport } from '../types';
 import { AlertTriangle, TrendingDown, TrendingUp, Archive, CheckCircle, Download, FileText, Truck, BarChart2, ScatterChart as ScatterIcon, RefreshCcw, Loader2, Search, X, Info, ChevronRight, Calculator, Layers, Package, ChevronUp, ChevronDown, Copy, Check } from 'lucide-react';
 import { generateExecutiveReport } from '../services/geminiService';
 import { 
@@ -20,7 +20,8 @@ interface AnalysisDashboardProps {
 export const AnalysisDashboard: React.FC<AnalysisDashboardProps> = ({ analysis, history, fileName, onReset, accessToken }) => {
   const [activeTab, setActiveTab] = useState<RiskCategory | 'Overview'>('Overview');
   const [isGeneratingReport, setIsGeneratingReport] = useState(false);
-  const [generatedReport, setGeneratedReport] = useState<{ emailText: string, htmlDashboard: string } | null>(null);
+  const [reportProgress, setReportProgress] = useState(0);
+  const [generatedReport, setGeneratedReport] = useState<ExecutiveReport | null>(null);
   const [showReportModal, setShowReportModal] = useState(false);
   const [isCopied, setIsCopied] = useState(false);
   const [apiError, setApiError] = useState<string | null>(null);
@@ -41,9 +42,10 @@ export const AnalysisDashboard: React.FC<AnalysisDashboardProps> = ({ analysis,
 
   const handleGenerateReport = async () => {
     setIsGeneratingReport(true);
+    setReportProgress(0);
     setApiError(null);
     try {
-      const report = await generateExecutiveReport(analysis, accessToken);
+      const report = await generateExecutiveReport(analysis, accessToken, false, setReportProgress);
       setGeneratedReport(report);
       setShowReportModal(true);
     } catch (e: any) {
@@ -299,7 +301,7 @@ export const AnalysisDashboard: React.FC<AnalysisDashboardProps> = ({ analysis,
             className="flex items-center justify-center gap-2 px-8 py-3.5 bg-indigo-600 text-white rounded-2xl hover:bg-indigo-700 transition-all disabled:opacity-50 font-bold shadow-indigo-200 shadow-xl active:scale-[0.98] text-sm"
           >
             {isGeneratingReport ? (
-              <><Loader2 className="animate-spin w-4 h-4" /> Synthesizing...</>
+              <><Loader2 className="animate-spin w-4 h-4" /> Synthesizing...{reportProgress > 0 && ` ${(reportProgress / 1024).toFixed(1)} KB`}</>
             ) : (
               <><FileText className="w-4 h-4" /> Generate AI Report</>
             )}
@@ -1,120 +1,352 @@
 import express from "express";
 import { createServer as createViteServer } from "vite";
-import cors from "cors";
 import path from "path";
+import cluster from "cluster";
+import { createHash, timingSafeEqual } from "crypto";
 import { fileURLToPath } from "url";
-import { GoogleGenAI, Type } from "@google/genai";
+import { setTimeout as sleep } from "timers/promises";
+import { GoogleGenAI, Type, type GenerateContentParameters, type Schema } from "@google/genai";
+import type { ExecutiveReport, ReportAnalysis } from "./types";
 
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = path.dirname(__filename);
 
+// Configuration is read once at startup; the handlers never touch process.env.
+const API_KEY = (process.env.GEMINI_API_KEY || process.env.API_KEY || "").trim();
+
+// Reuse a single Gemini client so every request shares the same
+// underlying connection pool instead of paying setup/TLS costs per call.
+let aiClient: GoogleGenAI | null = null;
+
+function getClient(): GoogleGenAI {
+  if (!aiClient) {
+    aiClient = new GoogleGenAI({ apiKey: API_KEY });
+  }
+  return aiClient;
+}
+
+// Digest of the configured access token, computed once. Comparing fixed-length
+// digests with timingSafeEqual avoids leaking the token through compare timing.
+const SERVER_ACCESS_TOKEN = process.env.ACCESS_TOKEN || process.env.VITE_ACCESS_TOKEN || "";
+const SERVER_ACCESS_DIGEST = createHash("sha256").update(SERVER_ACCESS_TOKEN).digest();
+
+function isAuthorized(clientToken: string | string[] | undefined): boolean {
+  if (!SERVER_ACCESS_TOKEN) return true;
+  if (typeof clientToken !== "string") return false;
+  const clientDigest = createHash("sha256").update(clientToken).digest();
+  return timingSafeEqual(clientDigest, SERVER_ACCESS_DIGEST);
+}
+
+const CORS_HEADERS = {
+  "Access-Control-Allow-Origin": process.env.CORS_ORIGIN || "*",
+  "Access-Control-Allow-Methods": "GET,POST,OPTIONS",
+  "Access-Control-Allow-Headers": "Content-Type,x-access-token",
+  "Access-Control-Max-Age": "86400",
+};
+
+const GEMINI_MODEL = "gemini-3-flash-preview";
+
+// Static part of the analysis prompt, sent as the system instruction; only the
+// inventory data changes per call.
+const ANALYST_INSTRUCTION = `You are an expert Inventory Analyst. You will receive a summary of inventory risk data followed by a list of critical items.
+
+TASK:
+1. Write a professional Executive Summary email (emailText) to the Supply Chain Director.
+   The email MUST be in Markdown format and include:
+   - A clear Subject Line at the top (use # for the header).
+   - A formal greeting (e.g., Dear Supply Chain Director,).
+   - Multiple paragraphs explaining the current inventory status, risks (shortfalls, oversupply, dead stock), and recommended actions.
+   - Use bold text (**SKU**) for critical items.
+   - Use bullet points for key items and recommendations.
+   - A professional sign-off and signature block.
+   - Use standard Markdown spacing between sections.
+2. Create a clean, interactive HTML dashboard (htmlDashboard) using Tailwind CSS. Use a dark theme with indigo accents.`;
+
+// Built once at load; only abortSignal varies per request.
+const REPORT_SCHEMA: Schema = {
+  type: Type.OBJECT,
+  properties: {
+    emailText: { type: Type.STRING, description: "Professional executive summary email" },
+    htmlDashboard: { type: Type.STRING, description: "Interactive HTML dashboard with Tailwind CSS" }
+  },
+  required: ["emailText", "htmlDashboard"]
+};
+
+const DIAGNOSTIC_REPLY = JSON.stringify({ emailText: "Diagnostic OK", htmlDashboard: "<div>Diagnostic OK</div>" });
+
+// Bounds on Gemini calls so a hung upstream connection can't park a request
+// indefinitely, without cutting off a healthy report that is still generating.
+// The call timeout covers setup and retries until the first streamed chunk (or
+// the whole call when not streaming); after that, only gaps between chunks are
+// bounded by the idle timeout.
+const GEMINI_CALL_TIMEOUT_MS = 60_000;
+const GEMINI_IDLE_TIMEOUT_MS = 20_000;
+const GEMINI_MAX_ATTEMPTS = 3;
+const GEMINI_RETRY_BASE_MS = 500;
+// 504 is Gemini's DEADLINE_EXCEEDED; it is distinct from our own timeouts, which abort the call.
+const RETRYABLE_STATUSES = new Set([429, 500, 503, 504]);
+
+// Retries transient Gemini failures (rate limiting, overload) with exponential
+// backoff. The signal stops the backoff early on disconnect or timeout.
+async function withRetries<T>(call: () => Promise<T>, signal: AbortSignal): Promise<T> {
+  for (let attempt = 1; ; attempt++) {
+    try {
+      return await call();
+    } catch (error: any) {
+      if (attempt >= GEMINI_MAX_ATTEMPTS || signal.aborted || !RETRYABLE_STATUSES.has(error?.status)) {
+        throw error;
+      }
+      console.warn(`[server] Gemini returned ${error.status}, retrying (attempt ${attempt + 1}/${GEMINI_MAX_ATTEMPTS})...`);
+      await sleep(GEMINI_RETRY_BASE_MS * 2 ** (attempt - 1), undefined, { signal });
+    }
+  }
+}
+
+// Returns the model's JSON text if it decodes to an ExecutiveReport; otherwise throws.
+function validateReportJson(text: string): string {
+  const body = text.trim();
+  const report: Partial<ExecutiveReport> = JSON.parse(body);
+  if (typeof report?.emailText !== "string" || typeof report?.htmlDashboard !== "string") {
+    throw new Error("Malformed response from AI");
+  }
+  return body;
+}
+
+function isReportItemList(value: unknown): boolean {
+  return Array.isArray(value) && value.every(r => typeof r?.sku === "string" && typeof r?.mohTotal === "number");
+}
+
+// Checks the fields buildAnalysisPrompt reads, so malformed bodies get a 400 up front.
+function isReportAnalysis(value: any): value is ReportAnalysis {
+  return typeof value === "object" && value !== null &&
+    typeof value.totalItems === "number" &&
+    typeof value.shortfallCount === "number" &&
+    typeof value.oversupplyCount === "number" &&
+    typeof value.deadStockCount === "number" &&
+    isReportItemList(value.topShortfall) &&
+    isReportItemList(value.topOversupply);
+}
+
+// Per-request part of the prompt: the aggregated risk counts and the most critical SKUs.
+function buildAnalysisPrompt(analysis: ReportAnalysis): string {
+  const criticalItems = [
+    ...analysis.topShortfall.slice(0, 10).map(r => ({ sku: r.sku, risk: 'Shortfall', moh: r.mohTotal })),
+    ...analysis.topOversupply.slice(0, 5).map(r => ({ sku: r.sku, risk: 'Oversupply', moh: r.mohTotal }))
+  ];
+
+  return `Analyze the following inventory risk data:
+
+SUMMARY:
+- Total Items: ${analysis.totalItems}
+- Shortfalls: ${analysis.shortfallCount}
+- Oversupply: ${analysis.oversupplyCount}
+- Dead Stock: ${analysis.deadStockCount}
+
+CRITICAL ITEMS:
+${JSON.stringify(criticalItems)}`;
+}
+
+// Finished reports keyed by a hash of the prompt. Dashboards re-request the same
+// snapshot (re-clicks, retries after a frontend error), and a hit skips Gemini entirely.
+const REPORT_CACHE_MAX_ENTRIES = 512;
+const REPORT_CACHE_TTL_MS = 10 * 60_000;
+const reportCache = new Map<string, { body: string; expiresAt: number }>();
+
+function getCachedReport(key: string): string | null {
+  const entry = reportCache.get(key);
+  if (!entry) return null;
+  if (Date.now() >= entry.expiresAt) {
+    reportCache.delete(key);
+    return null;
+  }
+  // Re-insert so Map iteration order tracks recency (LRU).
+  reportCache.delete(key);
+  reportCache.set(key, entry);
+  return entry.body;
+}
+
+function setCachedReport(key: string, body: string) {
+  reportCache.delete(key);
+  reportCache.set(key, { body, expiresAt: Date.now() + REPORT_CACHE_TTL_MS });
+  if (reportCache.size > REPORT_CACHE_MAX_ENTRIES) {
+    reportCache.delete(reportCache.keys().next().value!);
+  }
+}
+
 async function startServer() {
   console.log("[server] Initializing Inventory Agent Backend...");
   const app = express();
   const PORT = 3000;
 
-  app.use(cors());
-  app.use(express.json({ limit: '10mb' }));
+  if (!API_KEY) {
+    console.warn("[server] GEMINI_API_KEY is not set. /api/analyze will be unavailable.");
+  }
+
+  // Only the API is called cross-origin (e.g. a split dev setup); the SPA itself
+  // is same-origin. Fixed headers replace the generic cors() middleware.
+  app.use("/api", (req, res, next) => {
+    res.set(CORS_HEADERS);
+    if (req.method === "OPTIONS") {
+      return res.sendStatus(204);
+    }
+    next();
+  });
+  // Clients send only counts and a handful of items (see toReportAnalysis), so 1mb is ample.
+  // Larger bodies are rejected from Content-Length before any parsing happens.
+  app.use(express.json({ limit: '1mb' }));
+  app.use((err: any, req: express.Request, res: express.Response, next: express.NextFunction) => {
+    if (err?.type === "entity.too.large") {
+      return res.status(413).json({ error: "Payload too large." });
+    }
+    next(err);
+  });
 
   // API routes
   app.get("/api/health", (req, res) => {
-    const apiKey = (process.env.GEMINI_API_KEY || process.env.API_KEY || "").trim();
     res.json({ 
       status: "online", 
       version: "1.3.0", 
       engine: "typescript",
-      has_api_key: apiKey.length > 0 
+      has_api_key: API_KEY.length > 0 
     });
   });
 
   app.post("/api/analyze", async (req, res) => {
-    const { analysis, diagnosticMode } = req.body;
-    const apiKey = (process.env.GEMINI_API_KEY || process.env.API_KEY || "").trim();
-    const serverAccessToken = process.env.ACCESS_TOKEN || process.env.VITE_ACCESS_TOKEN;
-    const clientAccessToken = req.headers['x-access-token'];
+    const { analysis, diagnosticMode, stream } = req.body ?? {};
 
-    if (serverAccessToken && clientAccessToken !== serverAccessToken) {
+    if (!isAuthorized(req.headers['x-access-token'])) {
       return res.status(401).json({ error: "Unauthorized: Invalid access token." });
     }
 
-    if (!apiKey) {
+    if (!API_KEY) {
       return res.status(500).json({ error: "The AI service is currently unavailable because the Gemini API Key is missing on the server. Please contact the administrator." });
     }
 
     if (diagnosticMode) {
-      return res.json({ emailText: "Diagnostic OK", htmlDashboard: "<div>Diagnostic OK</div>" });
+      return res.type("application/json").send(DIAGNOSTIC_REPLY);
     }
 
+    if (!isReportAnalysis(analysis)) {
+      return res.status(400).json({ error: "Invalid request: 'analysis' is missing or malformed." });
+    }
+
+    // Cancel the upstream call if the browser goes away, so abandoned requests
+    // don't keep holding a Gemini connection until generation finishes.
+    const upstream = new AbortController();
+    res.on("close", () => {
+      if (!res.writableEnded) upstream.abort();
+    });
+    const timeout = new AbortController();
+    let timeoutTimer: ReturnType<typeof setTimeout> | undefined;
+    const armTimeout = (ms: number) => {
+      clearTimeout(timeoutTimer);
+      timeoutTimer = setTimeout(() => timeout.abort(), ms);
+    };
+    const signal = AbortSignal.any([upstream.signal, timeout.signal]);
+
     try {
-      const ai = new GoogleGenAI({ apiKey });
-      const model = await ai.models.generateContent({
-        model: "gemini-3-flash-preview",
+      const prompt = buildAnalysisPrompt(analysis);
+
+      const cacheKey = createHash("sha256").update(prompt).digest("hex");
+      const cachedBody = getCachedReport(cacheKey);
+      if (cachedBody) {
+        if (stream) {
+          res.type("application/x-ndjson").send(`${JSON.stringify({ delta: cachedBody })}\n{"done":true}\n`);
+        } else {
+          res.type("application/json").send(cachedBody);
+        }
+        return;
+      }
+
+      const ai = getClient();
+      armTimeout(GEMINI_CALL_TIMEOUT_MS);
+      const params: GenerateContentParameters = {
+        model: GEMINI_MODEL,
         config: {
+          systemInstruction: ANALYST_INSTRUCTION,
+          abortSignal: signal,
           responseMimeType: "application/json",
-          responseSchema: {
-            type: Type.OBJECT,
-            properties: {
-              emailText: { type: Type.STRING, description: "Professional executive summary email" },
-              htmlDashboard: { type: Type.STRING, description: "Interactive HTML dashboard with Tailwind CSS" }
-            },
-            required: ["emailText", "htmlDashboard"]
-          }
+          responseSchema: REPORT_SCHEMA
         },
         contents: [
           {
             parts: [
               {
-                text: `You are an expert Inventory Analyst. Analyze the following inventory risk data:
-                
-                SUMMARY:
-                - Total Items: ${analysis.totalItems}
-                - Shortfalls: ${analysis.shortfall.length}
-                - Oversupply: ${analysis.oversupply.length}
-                - Dead Stock: ${analysis.deadStock.length}
-                
-                CRITICAL ITEMS:
-                ${JSON.stringify([
-                  ...analysis.shortfall.slice(0, 10).map((r: any) => ({ sku: r.item.sku, risk: 'Shortfall', moh: r.item.mohTotal })),
-                  ...analysis.oversupply.slice(0, 5).map((r: any) => ({ sku: r.item.sku, risk: 'Oversupply', moh: r.item.mohTotal }))
-                ], null, 2)}
-                
-                TASK:
-                1. Write a professional Executive Summary email (emailText) to the Supply Chain Director.
-                   The email MUST be in Markdown format and include:
-                   - A clear Subject Line at the top (use # for the header).
-                   - A formal greeting (e.g., Dear Supply Chain Director,).
-                   - Multiple paragraphs explaining the current inventory status, risks (shortfalls, oversupply, dead stock), and recommended actions.
-                   - Use bold text (**SKU**) for critical items.
-                   - Use bullet points for key items and recommendations.
-                   - A professional sign-off and signature block.
-                   - Use standard Markdown spacing between sections.
-                2. Create a clean, interactive HTML dashboard (htmlDashboard) using Tailwind CSS. Use a dark theme with indigo accents.`
+                text: prompt
               }
             ]
           }
         ]
-      });
+      };
+
+      if (stream) {
+        // Forward tokens as NDJSON as soon as they arrive so the client sees the
+        // first bytes after first-token latency rather than full generation time.
+        let fullText = "";
+        const chunks = await withRetries(() => ai.models.generateContentStream(params), signal);
+        for await (const chunk of chunks) {
+          armTimeout(GEMINI_IDLE_TIMEOUT_MS);
+          const delta = chunk.text;
+          if (!delta) continue;
+          if (!res.headersSent) {
+            res.status(200).type("application/x-ndjson");
+            res.setHeader("Cache-Control", "no-cache");
+          }
+          fullText += delta;
+          res.write(JSON.stringify({ delta }) + "\n");
+        }
+        if (!fullText) {
+          throw new Error("Empty response from AI");
+        }
+        const body = validateReportJson(fullText);
+        setCachedReport(cacheKey, body);
+        // The client already holds every delta; it joins and parses them itself.
+        res.end(`{"done":true}\n`);
+        return;
+      }
 
+      const model = await withRetries(() => ai.models.generateContent(params), signal);
       const text = model.text;
       if (!text) {
         throw new Error("Empty response from AI");
       }
 
-      res.json(JSON.parse(text));
+      // The reply is already JSON: validate it once, then forward the text as-is
+      // instead of re-serializing the parsed object through res.json().
+      const body = validateReportJson(text);
+      setCachedReport(cacheKey, body);
+      res.type("application/json").send(body);
     } catch (error: any) {
+      if (upstream.signal.aborted) {
+        console.warn("[server] Client disconnected, Gemini request aborted.");
+        return;
+      }
       console.error("[server] Gemini Error:", error);
+      let status = 500;
       let errorMessage = error.message || "Failed to generate AI report";
-      
+
       // Detect common Gemini API key issues (expired, invalid, missing)
-      if (errorMessage.includes("API_KEY_INVALID") || 
+      const isKeyError = errorMessage.includes("API_KEY_INVALID") || 
           errorMessage.includes("API key expired") || 
           errorMessage.includes("INVALID_ARGUMENT") ||
           errorMessage.includes("400") ||
-          errorMessage.includes("403")) {
+          errorMessage.includes("403");
+
+      if (timeout.signal.aborted) {
+        status = 504;
+        errorMessage = "The AI service took too long to respond. Please try again in a moment.";
+      } else if (isKeyError) {
         errorMessage = "The AI service is currently unavailable due to an invalid or expired API key. Please contact the administrator to renew the GEMINI_API_KEY in the environment settings.";
       }
       
-      res.status(500).json({ error: errorMessage });
+      // Once a stream has started the status line is gone; report the error in-band.
+      if (res.headersSent) {
+        res.end(JSON.stringify({ error: errorMessage }) + "\n");
+        return;
+      }
+      res.status(status).json({ error: errorMessage });
+    } finally {
+      clearTimeout(timeoutTimer);
     }
   });
 
@@ -126,16 +358,64 @@ async function startServer() {
     });
     app.use(vite.middlewares);
   } else {
-    app.use(express.static("dist"));
+    // Vite fingerprints everything under dist/assets, so those files never change
+    // at a given URL and can be cached by the browser for a year.
+    app.use("/assets", express.static(path.join(process.cwd(), "dist", "assets"), {
+      immutable: true,
+      maxAge: "1y",
+    }));
+    // index.html (and anything else outside assets/) must pick up new deploys, so
+    // it is revalidated on every visit; the ETag makes repeat loads a 304.
+    app.use(express.static("dist", {
+      setHeaders: (res) => res.setHeader("Cache-Control", "no-cache"),
+    }));
     app.get('*all', (req, res) => {
-      res.sendFile(path.join(process.cwd(), 'dist', 'index.html'));
+      res.sendFile(path.join(process.cwd(), 'dist', 'index.html'), {
+        headers: { "Cache-Control": "no-cache" },
+      });
     });
   }
 
   app.listen(PORT, "0.0.0.0", () => {
     console.log(`[server] Inventory Agent Backend v1.3.0`);
-    console.log(`[server] Running on port ${PORT}`);
+    console.log(`[server] Running on port ${PORT}${cluster.isWorker ? ` (worker ${process.pid})` : ""}`);
   });
 }
 
-startServer();
+// Express already serves the I/O-bound Gemini route concurrently, so one process
+// is the default. Setting WEB_CONCURRENCY in production forks that many workers
+// sharing the port; each keeps its own report cache.
+const workerCount = Number(process.env.WEB_CONCURRENCY) || 1;
+
+// Workers that die soon after starting (e.g. EADDRINUSE at boot) are restarted
+// with exponential backoff instead of in a tight fork loop.
+const WORKER_STABLE_UPTIME_MS = 30_000;
+const WORKER_RESTART_BASE_MS = 1000;
+const WORKER_RESTART_MAX_MS = 30_000;
+
+if (process.env.NODE_ENV === "production" && workerCount > 1 && cluster.isPrimary) {
+  const workerStartedAt = new Map<number, number>();
+  let quickExits = 0;
+
+  const forkWorker = () => {
+    const worker = cluster.fork();
+    workerStartedAt.set(worker.id, Date.now());
+  };
+
+  console.log(`[server] Starting ${workerCount} workers...`);
+  for (let i = 0; i < workerCount; i++) {
+    forkWorker();
+  }
+  cluster.on("exit", (worker, code, signal) => {
+    const uptime = Date.now() - (workerStartedAt.get(worker.id) ?? 0);
+    workerStartedAt.delete(worker.id);
+    quickExits = uptime < WORKER_STABLE_UPTIME_MS ? quickExits + 1 : 0;
+    const delay = quickExits > 0
+      ? Math.min(WORKER_RESTART_BASE_MS * 2 ** (quickExits - 1), WORKER_RESTART_MAX_MS)
+      : 0;
+    console.warn(`[server] Worker ${worker.process.pid} exited (${signal || code}). Restarting in ${delay}ms...`);
+    setTimeout(forkWorker, delay);
+  });
+} else {
+  startServer();
+}
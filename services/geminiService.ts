@@ -1,10 +1,65 @@
-import { AggregatedAnalysis } from '../types';
+import { AggregatedAnalysis, AnalysisResult, ExecutiveReport, ReportAnalysis, ReportItem } from '../types';
+
+// Only the top shortfall/oversupply items are named in the report prompt
+const TOP_SHORTFALL_ITEMS = 10;
+const TOP_OVERSUPPLY_ITEMS = 5;
+
+const toReportItems = (results: AnalysisResult[], limit: number): ReportItem[] =>
+  results.slice(0, limit).map(({ item }) => ({ sku: item.sku, mohTotal: item.mohTotal }));
+
+// Reduce the analysis to what the report prompt uses; sending full result lists
+// (or allItems with raw spreadsheet rows) would grow the body with the inventory.
+const toReportAnalysis = (analysis: AggregatedAnalysis): ReportAnalysis => ({
+  totalItems: analysis.totalItems,
+  shortfallCount: analysis.shortfall.length,
+  oversupplyCount: analysis.oversupply.length,
+  deadStockCount: analysis.deadStock.length,
+  topShortfall: toReportItems(analysis.shortfall, TOP_SHORTFALL_ITEMS),
+  topOversupply: toReportItems(analysis.oversupply, TOP_OVERSUPPLY_ITEMS),
+});
+
+// Reads the NDJSON stream emitted by /api/analyze and resolves with the report
+// assembled from its deltas.
+const readReportStream = async (
+  response: Response,
+  onProgress?: (receivedChars: number) => void
+): Promise<ExecutiveReport> => {
+  const reader = response.body!.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let reportText = '';
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let newline: number;
+    while ((newline = buffer.indexOf('\n')) !== -1) {
+      const line = buffer.slice(0, newline).trim();
+      buffer = buffer.slice(newline + 1);
+      if (!line) continue;
+
+      const message = JSON.parse(line);
+      if (message.error) throw new Error(message.error);
+      // The server validates the joined text before signalling done
+      if (message.done) return JSON.parse(reportText);
+      if (message.delta) {
+        reportText += message.delta;
+        onProgress?.(reportText.length);
+      }
+    }
+  }
+
+  throw new Error("Report stream ended unexpectedly");
+};
 
 export const generateExecutiveReport = async (
   analysis: AggregatedAnalysis, 
   accessToken: string,
-  diagnosticMode: boolean = false
-) => {
+  diagnosticMode: boolean = false,
+  onProgress?: (receivedChars: number) => void
+): Promise<ExecutiveReport> => {
   try {
     const response = await fetch('/api/analyze', {
       method: 'POST',
@@ -12,7 +67,7 @@ export const generateExecutiveReport = async (
         'Content-Type': 'application/json',
         'x-access-token': accessToken,
       },
-      body: JSON.stringify({ analysis, diagnosticMode }),
+      body: JSON.stringify({ analysis: toReportAnalysis(analysis), diagnosticMode, stream: true }),
     });
 
     if (!response.ok) {
@@ -20,6 +75,11 @@ export const generateExecutiveReport = async (
       throw new Error(errorData.error || `Server responded with ${response.status}`);
     }
 
+    // Diagnostic replies (and older servers) answer with plain JSON instead of a stream
+    if (response.body && response.headers.get('Content-Type')?.includes('application/x-ndjson')) {
+      return await readReportStream(response, onProgress);
+    }
+
     return await response.json();
   } catch (error: any) {
     console.error("Gemini Service Error:", error);
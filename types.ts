@@ -49,6 +49,28 @@ export interface AggregatedAnalysis {
   totalItems: number;
 }
 
+// Request body for /api/analyze: the risk counts plus the few items the report
+// prompt names, so the payload stays small regardless of inventory size.
+export interface ReportItem {
+  sku: string;
+  mohTotal: number;
+}
+
+export interface ReportAnalysis {
+  totalItems: number;
+  shortfallCount: number;
+  oversupplyCount: number;
+  deadStockCount: number;
+  topShortfall: ReportItem[];
+  topOversupply: ReportItem[];
+}
+
+// Shape of the JSON returned by /api/analyze (matches REPORT_SCHEMA in server.ts).
+export interface ExecutiveReport {
+  emailText: string;
+  htmlDashboard: string;
+}
+
 export type UserRole = 'admin' | 'standard';
 
 export interface User {